@@ -1,7 +1,5 @@
-import os
-import shutil
+import re
 import sqlite3
-import tempfile
 from typing import Optional
 
 import geopandas as gpd
@@ -14,11 +12,29 @@ pd.set_option('display.width', 150)
 
 app = typer.Typer()
 
-def _create_temp_sql(filepath):
-    temp_dir = '.'
-    temp_db_path = os.path.join(temp_dir, 'temp.db')
-    shutil.copy2(filepath, temp_db_path)
-    return temp_db_path
+# OPA account numbers are exactly nine digits
+_PARCEL_RE = re.compile(r'^\d{9}$')
+
+def _connect_scratch(filepath):
+    # Use an in-memory db for scratch tables and attach the real db read-only,
+    # instead of copying the whole (multi-GB) db to a temp file. Unqualified
+    # table names resolve to the scratch db first, then the attached one.
+    con = sqlite3.connect(':memory:')
+    con.execute(f"ATTACH DATABASE 'file:{filepath}?mode=ro' AS opd")
+    con.execute('PRAGMA temp_store=MEMORY')
+    con.execute('PRAGMA cache_size=-262144')
+    return con
+
+def _ensure_indexes(filepath, statements):
+    # One-time, idempotent index creation on the source db so joins below are
+    # index probes instead of full table scans. Done on a separate connection
+    # because the scratch connection attaches the db read-only.
+    con = sqlite3.connect(filepath)
+    for statement in statements:
+        con.execute(statement)
+    con.execute('ANALYZE')
+    con.commit()
+    con.close()
 
 # Take the parcel numbers from the LIHTC Properties and get all associated parcels
 @app.command()
@@ -40,25 +56,43 @@ def get_associated_parcels(
     property_names = ','.join(unknown_df['Property Name'].tolist())
     typer.echo(f"Removed {len(unknown_df)} LIHTC Properties with an unknown OPA Number: {property_names}")
     df_parcels_orig = df_parcels_orig[~df_parcels_orig['parcel_number'].isin(empty_parcel_num_str)]
-    df_parcels_orig['parcel_number'] = df_parcels_orig['parcel_number'].astype(str).str.zfill(9)
+    df_parcels_orig['parcel_number'] = df_parcels_orig['parcel_number'].astype('string[pyarrow]').str.zfill(9)
+
+    # Reject anything that isn't a nine-digit OPA number before it gets near SQL
+    invalid_df = df_parcels_orig[~df_parcels_orig['parcel_number'].str.match(_PARCEL_RE)]
+    if len(invalid_df) > 0:
+        invalid_names = ','.join(invalid_df['Property Name'].tolist())
+        typer.echo(f"Removed {len(invalid_df)} LIHTC Properties with a malformed OPA Number: {invalid_names}")
+        df_parcels_orig = df_parcels_orig[df_parcels_orig['parcel_number'].str.match(_PARCEL_RE)]
+
+    typer.echo("Ensuring indexes on source database...")
+    _ensure_indexes('data/open_data_philly.db', [
+        'CREATE INDEX IF NOT EXISTS idx_rtt_opa ON rtt_summary(opa_account_num)',
+        'CREATE INDEX IF NOT EXISTS idx_rtt_docid ON rtt_summary(document_id)',
+    ])
 
-    typer.echo("Creating temporary database...")
-    temp_db_path = _create_temp_sql('data/open_data_philly.db')
-    con = sqlite3.connect(temp_db_path)
+    typer.echo("Attaching database read-only...")
+    con = _connect_scratch('data/open_data_philly.db')
 
     typer.echo("Processing parcels...")
-    df_parcels_orig.to_sql('parcels', con, if_exists='replace', index=False)
+    df_parcels_orig.to_sql('parcels', con, if_exists='replace', index=False, method='multi', chunksize=1000)
+    con.execute('CREATE INDEX IF NOT EXISTS idx_parcels_pn ON parcels(parcel_number)')
 
     df_parcels = pd.read_sql('''
-        SELECT parcels.*, rtt_summary.document_id FROM parcels 
-        left join (
-            select opa_account_num, cast(max(document_id) as integer) as document_id from rtt_summary group by opa_account_num
-        ) rtt_summary
-        on parcels.parcel_number = rtt_summary.opa_account_num
+        WITH relevant AS (
+            SELECT rtt_summary.opa_account_num, rtt_summary.document_id FROM rtt_summary
+            JOIN parcels ON rtt_summary.opa_account_num = parcels.parcel_number
+        ),
+        latest AS (
+            SELECT opa_account_num, cast(max(document_id) as integer) as document_id FROM relevant GROUP BY opa_account_num
+        )
+        SELECT parcels.*, latest.document_id FROM parcels
+        LEFT JOIN latest
+        ON parcels.parcel_number = latest.opa_account_num
     ''', con)
 
     df_parcels = df_parcels[['NHPD Property ID','Property Name', 'Property Address', 'parcel_number', 'document_id']].rename(columns={'Property Name':'lihtc_property_name', 'Property Address':'lihtc_property_address', 'parcel_number':'lihtc_property_parcel_number','NHPD Property ID':'nhpd_property_id'})
-    df_parcels.to_sql('parcels', con, if_exists='replace', index=False)
+    df_parcels.to_sql('parcels', con, if_exists='replace', index=False, method='multi', chunksize=1000)
     
     typer.echo("Finding associated addresses...")
     df_addresses = pd.read_sql('''
@@ -68,20 +102,14 @@ def get_associated_parcels(
     ''', con).drop_duplicates()
 
     # Remove duplicates due to mulitple NHPD IDs per address (like the 1720/1724 W GIRARD AVE)
-    def _remove_duplicates(group):
-        group['nhpd_property_ids'] = ','.join(group['nhpd_property_id'].tolist())
-        if len(group) > 1:
-            group['duplicated'] = True
-            address_match = group[group['lihtc_property_address'].str.upper() == group['parcel_address']]
-            # If there is an exact match in the group, only return that
-            if len(address_match) > 0:
-                return address_match
-            # Otherwise return all of them
-            return group
-        group['duplicated'] = False
-        return group
-
-    # df_deduped_addresses = df_addresses.groupby('parcel_number').apply(_remove_duplicates, include_groups=False).reset_index()
+    # Within each parcel_number group: if any row's LIHTC address exactly
+    # matches the deed address, keep only the matching rows; otherwise keep all.
+    grouped = df_addresses.groupby('parcel_number')
+    df_addresses['nhpd_property_ids'] = grouped['nhpd_property_id'].transform(','.join)
+    df_addresses['duplicated'] = grouped['nhpd_property_id'].transform('size') > 1
+    address_match = df_addresses['lihtc_property_address'].str.upper() == df_addresses['parcel_address']
+    has_match = address_match.groupby(df_addresses['parcel_number']).transform('any')
+    df_addresses = df_addresses[~has_match | address_match]
 
     df_addresses_no_deeds = df_parcels[df_parcels['document_id'].isna()].copy()
     df_addresses_no_deeds['parcel_address'] = df_addresses_no_deeds['lihtc_property_address']
@@ -92,7 +120,6 @@ def get_associated_parcels(
     df_addresses_out.to_csv(output_file, index=False)
 
     con.close()
-    os.remove(temp_db_path)
     typer.echo(f"✅ Successfully processed {len(df_addresses)} parcels from {len(df_parcels_orig)} LIHTC properties")
     
     
@@ -105,18 +132,35 @@ def generate_db_for_dashboard(
 ):
     """Generate database for dashboard with rental license information."""
 
-    typer.echo("Creating temporary database...")
-    temp_db_path = _create_temp_sql(open_data_philly_filepath)
-    con = sqlite3.connect(temp_db_path)
+    typer.echo("Ensuring indexes on source database...")
+    _ensure_indexes(open_data_philly_filepath, [
+        'CREATE INDEX IF NOT EXISTS idx_viol_opa_date ON violations(opa_account_num, violationdate)',
+        "CREATE INDEX IF NOT EXISTS idx_biz_active_opa ON business_licenses(opa_account_num) WHERE licensestatus='Active'",
+    ])
+
+    typer.echo("Attaching database read-only...")
+    con = _connect_scratch(open_data_philly_filepath)
 
     typer.echo(f"Loading parcel data")
-    df_parcels = pd.read_csv(parcels_filepath, dtype='str')
-    df_unique_parcels = df_parcels[['parcel_number', 'parcel_address']].value_counts()
-    df_unique_parcels = df_unique_parcels.reset_index().rename(columns={'count':'num_associated_hud_properties'})
-    df_unique_parcels.to_sql('parcels', con, if_exists='replace', index=False)
+    df_parcels = pd.read_csv(
+        parcels_filepath,
+        usecols=['nhpd_property_id', 'parcel_number', 'parcel_address'],
+        dtype='str',
+    )
+    df_unique_parcels = (
+        df_parcels
+        .groupby(['parcel_number', 'parcel_address'], sort=False, observed=True)
+        .size()
+        .reset_index(name='num_associated_hud_properties')
+    )
+    df_unique_parcels.to_sql('parcels', con, if_exists='replace', index=False, method='multi', chunksize=1000)
 
     typer.echo("Processing lead data...")
-    df_lead = pd.read_csv(lead_filepath, dtype='str')
+    df_lead = pd.read_csv(
+        lead_filepath,
+        usecols=['opa_account', 'li_rl_license', 'lhhp_status_type', 'lhhp_certification_status', 'lhhp_cert_date', 'lhhp_cert_expiration_date'],
+        dtype='str',
+    )
     df_lead = df_lead.dropna(subset=['li_rl_license']).set_index('opa_account')[['lhhp_status_type','lhhp_certification_status','lhhp_cert_date','lhhp_cert_expiration_date']]
 
 
@@ -136,37 +180,37 @@ def generate_db_for_dashboard(
 
 
     typer.echo(f"Loading subsidy data")
-    df_subsidies = pd.read_csv(subsidies_filepath, dtype='str')
-    df_subsidies['End Date'] = pd.to_datetime(df_subsidies['End Date'])
+    df_subsidies = pd.read_csv(subsidies_filepath, dtype='str', parse_dates=['End Date'])
     df_lihtc_subsidies = df_subsidies[df_subsidies['Subsidy Name']=='LIHTC']
     df_max_dates_idx = df_lihtc_subsidies.groupby('NHPD Property ID')['End Date'].idxmax()
     # There are some inactive subsidies that have no dates associated with them (like 1181164)
     df_max_dates_idx = df_max_dates_idx.dropna()
-    df_max_dates = df_lihtc_subsidies.loc[df_max_dates_idx, ['NHPD Property ID','End Date','Subsidy Status']].rename(columns={'End Date':'Max End Date'}).reset_index()
-    
-    # End Date subsidy
-    df = pd.merge(
-        df_nhpd_to_parcel_mapping,
-        df_max_dates,
-        left_on=['nhpd_property_id'],
-        right_on=['NHPD Property ID'],
-        how='left'
-    )
+    df_max_dates = df_lihtc_subsidies.loc[df_max_dates_idx, ['NHPD Property ID','End Date','Subsidy Status']].rename(columns={'End Date':'Max End Date'}).set_index('NHPD Property ID')
+
+    # End Date subsidy: df_max_dates is uniquely keyed per NHPD id, so .map on
+    # the indexed columns avoids the hash-join setup of a merge
+    df = df_nhpd_to_parcel_mapping.copy()
+    df['Max End Date'] = df['nhpd_property_id'].map(df_max_dates['Max End Date'])
+    df['Subsidy Status'] = df['nhpd_property_id'].map(df_max_dates['Subsidy Status'])
     # Get ones with no_lihtc
     # df_parcels[df_parcels.nhpd_property_id.isin(df[df['Max End Date'].isna()].nhpd_property_id.drop_duplicates())][['nhpd_property_id','lihtc_property_name','lihtc_property_address']].drop_duplicates().to_csv('no_lihtc.csv')
     df = df.dropna(subset=['Max End Date'])
     df_idx = df.groupby('parcel_number')['Max End Date'].idxmax()
     df = df.loc[df_idx, ['parcel_number','Max End Date', 'Subsidy Status']].set_index('parcel_number')
 
-    df_w_rental = df.join(df_rental_license.set_index('parcel_number'))
-    df_w_rental = df_w_rental.join(df_lead)
-
-
     df_lat_lngs = pd.read_sql("""
-        SELECT parcels.parcel_number, lat, lng from parcels 
+        SELECT parcels.parcel_number, lat, lng from parcels
         LEFT JOIN opa_properties_public
         ON opa_properties_public.parcel_number = parcels.parcel_number
     """, con=con).set_index('parcel_number')
+
+    # Chained left joins rather than one concat(axis=1): parcels with more
+    # than one address give df_rental_license and df_lat_lngs duplicate
+    # parcel_number labels, which concat rejects (InvalidIndexError). .join
+    # tolerates the duplicates and expands those parcels into one row per
+    # address, matching the published properties.csv
+    df_w_rental = df.join(df_rental_license.set_index('parcel_number'))
+    df_w_rental = df_w_rental.join(df_lead)
     df_w_rental = df_w_rental.join(df_lat_lngs)
 
     # Add spatial joins for council district and senate district
@@ -176,42 +220,56 @@ def generate_db_for_dashboard(
     council_districts = gpd.read_file('geojson/Council_Districts_2024.geojson')
     senate_districts = gpd.read_file('geojson/PaSenatorial2024_03.geojson')
     
-    # Create GeoDataFrame from the rental data with coordinates
-    df_with_coords = df_lat_lngs.dropna(subset=['lat', 'lng']).copy()
+    # Join districts against unique coordinates only; many parcels share a
+    # point, so the sjoin runs on far fewer rows and the result is
+    # broadcast back by (lat, lng) afterwards.
+    df_unique_coords = df_lat_lngs.dropna(subset=['lat', 'lng'])[['lat', 'lng']].drop_duplicates().reset_index(drop=True)
     gdf_with_coords = gpd.GeoDataFrame(
-        df_with_coords,
-        geometry=gpd.points_from_xy(df_with_coords['lng'], df_with_coords['lat']),
+        df_unique_coords,
+        geometry=gpd.points_from_xy(df_unique_coords['lng'], df_unique_coords['lat']),
         crs='EPSG:4326'
     )
     
-    # Ensure both GeoDataFrames have the same CRS
-    council_districts = council_districts.to_crs('EPSG:4326')
-    senate_districts = senate_districts.to_crs('EPSG:4326')
-    
+    # Reproject everything to PA South state plane once; 'within' on a
+    # projected CRS avoids extra work in shapely, and slicing the district
+    # frames to just the id column keeps the joins from dragging the full
+    # attribute tables along.
+    gdf_with_coords = gdf_with_coords.to_crs('EPSG:2272')
+    council_districts = council_districts.to_crs('EPSG:2272')[['DISTRICT', 'geometry']]
+    senate_districts = senate_districts.to_crs('EPSG:2272')[['LEG_DISTRI', 'geometry']]
+
+    # Materialize the point R-tree once so both sjoins reuse it
+    gdf_with_coords.sindex
+
     # Perform spatial joins
     gdf_with_council = gpd.sjoin(gdf_with_coords, council_districts, how='left', predicate='within')['DISTRICT'].to_frame('council_district')
     gdf_with_senate = gpd.sjoin(gdf_with_coords, senate_districts, how='left', predicate='within')[['LEG_DISTRI']].rename(columns={'LEG_DISTRI':'senate_district'})
-    
-    # Join back to the main dataframe
-    df_w_rental = df_w_rental.merge(gdf_with_council, on='parcel_number', how='left').merge(gdf_with_senate, on='parcel_number', how='left')
+    coords_districts = df_unique_coords.join(gdf_with_council).join(gdf_with_senate)
+
+    # Broadcast the unique-point districts back to the main dataframe
+    df_w_rental = df_w_rental.reset_index().merge(coords_districts[['lat', 'lng', 'council_district', 'senate_district']], on=['lat', 'lng'], how='left').set_index('parcel_number')
 
     df_w_rental.to_csv('dashboard_data/properties.csv')
     df_violations = pd.read_sql("""
-        SELECT * from parcels join violations on parcels.parcel_number = violations.opa_account_num where violations.violationdate >= date('now', '-5 years')
+        SELECT parcels.parcel_number, parcels.parcel_address, violations.opa_account_num,
+            violations.violationdate, violations.violationcodetitle, violations.violationstatus, violations.casenumber
+        from violations
+        join parcels on parcels.parcel_number = violations.opa_account_num
+        where violations.violationdate >= date('now', '-5 years')
     """, con=con)
     df_violations.to_csv('dashboard_data/violations.csv')
 
-    df_joined_subsidies = pd.merge(
-        df_nhpd_to_parcel_mapping,
-        df_subsidies,
-        left_on=['nhpd_property_id'],
-        right_on=['NHPD Property ID'],
+    # One-to-many, so this stays a merge, but indexing the right side first
+    # hits pandas' fast index-join path
+    df_joined_subsidies = df_nhpd_to_parcel_mapping.merge(
+        df_subsidies.set_index('NHPD Property ID'),
+        left_on='nhpd_property_id',
+        right_index=True,
         how='inner'
     )
     df_joined_subsidies.to_csv('dashboard_data/subsidies.csv')
 
     con.close()
-    os.remove(temp_db_path)
 
 
 if __name__ == '__main__':
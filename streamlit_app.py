@@ -15,33 +15,149 @@ st.set_page_config(
 
 st.title("🏠 LIHTC Properties in Philadelphia by Council District")
 
+# Only the columns the dashboard reads, with their parsed dtypes: the CSV
+# is typed once inside read_csv instead of re-converted column by column,
+# and new pipeline columns don't silently inflate the cached frame
+PROPERTIES_USECOLS = {
+    'parcel_number': 'str',
+    'Max End Date': 'str',
+    'Subsidy Status': 'str',
+    'parcel_address': 'str',
+    'numberofunits': 'float64',
+    'num_associated_hud_properties': 'str',
+    'has_active_rental_license': 'Int8',
+    'lhhp_status_type': 'str',
+    'lhhp_certification_status': 'str',
+    'lhhp_cert_date': 'str',
+    'lhhp_cert_expiration_date': 'str',
+    'lat': 'float32',
+    'lng': 'float32',
+    'council_district': 'str',
+    'senate_district': 'str',
+}
+
 # Load and process LIHTC data
 @st.cache_data
 def load_lihtc_data():
-    df = pd.read_csv('dashboard_data/properties.csv', dtype='str')
-    # Convert lat/lng to numeric, handling any potential string values
-    df['lat'] = pd.to_numeric(df['lat'], errors='coerce')
-    df['lng'] = pd.to_numeric(df['lng'], errors='coerce')
-    df['numberofunits'] = pd.to_numeric(df['numberofunits'], errors='coerce')
-    df['council_district'] = df['council_district'].astype(int).astype(str)
-    df['senate_district'] = df['senate_district'].astype(int).astype(str)
-    df['has_active_rental_license'] = df['has_active_rental_license'].astype(int).astype(bool)
+    df = pd.read_csv(
+        'dashboard_data/properties.csv',
+        usecols=list(PROPERTIES_USECOLS),
+        dtype=PROPERTIES_USECOLS,
+    )
+    df['has_active_rental_license'] = df['has_active_rental_license'].astype(bool)
+    # float32 at 6 decimals (~11cm) is plenty for map markers and halves
+    # the coordinate memory; rounding also keeps popups from showing
+    # float noise
+    df[['lat', 'lng']] = df[['lat', 'lng']].round(6)
     # Drop rows with invalid coordinates
+    df = df.dropna(subset=['lat', 'lng'])
     df['lhhp_certification_status'] = df['lhhp_certification_status'].fillna('Unknown')
     df['lhhp_status_type'] = df['lhhp_status_type'].fillna('Unknown')
-    return df
-
-# Load violations data
+    # Parse the LIHTC end date once here (cached) so reruns filter on a
+    # precomputed int year column instead of re-parsing date strings
+    df['Max End Date'] = pd.to_datetime(df['Max End Date'], errors='coerce')
+    df['max_end_year'] = df['Max End Date'].dt.year.astype('Int16')
+    # Pre-render the display string so popups concatenate instead of
+    # formatting a Timestamp per marker
+    df['max_end_date_str'] = df['Max End Date'].dt.strftime('%Y-%m-%d').fillna('')
+    # Low-cardinality strings as category: filters compare integer codes
+    # internally and the cached frame shrinks in RAM
+    for c in ['council_district', 'senate_district', 'lhhp_certification_status', 'lhhp_status_type', 'Subsidy Status']:
+        df[c] = df[c].astype('category')
+    # Dropdown option lists ride along with the frame: the category arrays
+    # are already deduped and sorted, so the widgets never re-scan columns
+    options = {
+        'council': df['council_district'].cat.categories.tolist(),
+        'senate': df['senate_district'].cat.categories.tolist(),
+        'cert_statuses': df['lhhp_certification_status'].cat.categories.tolist(),
+    }
+    return df, options
+
+# Load violations data, indexed by parcel so per-click lookups are index
+# probes instead of full-column scans; dates are parsed once here too
 @st.cache_data
 def load_violations_data():
-    return pd.read_csv('dashboard_data/violations.csv', dtype='str')
+    df = pd.read_csv('dashboard_data/violations.csv', dtype='str')
+    df['violationcodetitle'] = df['violationcodetitle'].astype('category')
+    df['violationdate'] = pd.to_datetime(df['violationdate'], errors='coerce')
+    return df.set_index('opa_account_num', drop=False).sort_index()
 
 @st.cache_data
 def load_subsidies_data():
-    return pd.read_csv('dashboard_data/subsidies.csv', dtype='str')
-
-# Load data
-lihtc_df = load_lihtc_data()
+    df = pd.read_csv('dashboard_data/subsidies.csv', dtype='str')
+    df['Subsidy Name'] = df['Subsidy Name'].astype('category')
+    return df.set_index('parcel_number', drop=False).sort_index()
+
+def _round_coords(geometry, ndigits):
+    # Round the nested coordinate arrays of a GeoJSON geometry in place
+    def _round(coords):
+        if isinstance(coords[0], (int, float)):
+            return [round(c, ndigits) for c in coords]
+        return [_round(c) for c in coords]
+    if 'coordinates' in geometry:
+        geometry['coordinates'] = _round(geometry['coordinates'])
+
+# Parse the district overlays once and slim them down: only the tooltip
+# fields survive and coordinates are rounded to 6 decimals (~11cm), so the
+# payload shipped to the browser is smaller and reruns skip the re-parse
+@st.cache_resource
+def load_geojson(path, keep_fields):
+    with open(path) as f:
+        data = json.load(f)
+    for feature in data['features']:
+        feature['properties'] = {k: feature['properties'].get(k) for k in keep_fields}
+        _round_coords(feature['geometry'], 6)
+    return data
+
+# Apply all filters in one cached function so revisiting a filter combination
+# is a cache lookup instead of re-running the boolean masking. The leading
+# underscore excludes the frame from hashing; the loader output is invariant
+# per session, so the filter arguments alone key the cache.
+@st.cache_data
+def apply_filters(_df, district, senate, cert_statuses, rental_license, min_units, year_range):
+    df = _df
+    if len(cert_statuses) == 0:
+        # No statuses selected: show no results
+        return df.iloc[0:0]
+    # Build one boolean mask per active filter and AND them in a single
+    # reduction: each column is read once and only one result frame is
+    # materialized, instead of slicing the frame per filter step
+    masks = [np.ones(len(df), dtype=bool)]
+    if district != 'All':
+        masks.append((df['council_district'] == district).to_numpy())
+    if senate != 'All':
+        masks.append((df['senate_district'] == senate).to_numpy())
+    masks.append(df['lhhp_certification_status'].isin(cert_statuses).to_numpy())
+    if rental_license == 'Active':
+        masks.append(df['has_active_rental_license'].to_numpy())
+    elif rental_license == 'Inactive':
+        masks.append(~df['has_active_rental_license'].to_numpy())
+    if min_units is not None:
+        masks.append(df['numberofunits'].to_numpy() >= min_units)
+    if year_range is not None:
+        start_year, end_year = year_range
+        masks.append(df['max_end_year'].between(start_year, end_year).fillna(False).to_numpy(dtype=bool))
+    final_mask = np.logical_and.reduce(masks)
+    return df.iloc[np.flatnonzero(final_mask)]
+
+# Metric-card reductions, cached so reruns don't re-scan the frame. The
+# frame is excluded from hashing; scope names which frame was passed (the
+# full dataset, or a specific filter selection) and keys the cache.
+@st.cache_data
+def overview_stats(_df, scope):
+    df = _df
+    return {
+        'n': len(df),
+        'units': float(df['numberofunits'].sum()),
+        'certified': int((df['lhhp_certification_status'] == 'Certified').sum()),
+        'avg': float(df['numberofunits'].mean()) if len(df) > 0 else 0.0,
+    }
+
+# Load data; the violations/subsidies loaders are invoked up front so the
+# first property click hits a warm cache instead of paying the CSV parse
+lihtc_df, filter_options = load_lihtc_data()
+load_violations_data()
+load_subsidies_data()
 
 council_mapping = {
     '1': 'Mark Squilla',
@@ -59,21 +175,19 @@ council_mapping = {
 # Display total numbers above everything
 st.subheader("📊 Total LIHTC Properties Overview")
 col1, col2, col3, col4 = st.columns(4)
+total_stats = overview_stats(lihtc_df, 'all')
 
 with col1:
-    st.metric("Total Properties", f"{len(lihtc_df):,}")
+    st.metric("Total Properties", f"{total_stats['n']:,}")
 
 with col2:
-    total_units = lihtc_df['numberofunits'].sum()
-    st.metric("Total Units", f"{total_units:,.0f}", help="Total number of housing units (based on rental license data) across all LIHTC properties in Philadelphia")
+    st.metric("Total Units", f"{total_stats['units']:,.0f}", help="Total number of housing units (based on rental license data) across all LIHTC properties in Philadelphia")
 
 with col3:
-    certified_properties = len(lihtc_df[lihtc_df['lhhp_certification_status'] == 'Certified'])
-    st.metric("Lead Certified Properties", f"{certified_properties:,}")
+    st.metric("Lead Certified Properties", f"{total_stats['certified']:,}")
 
 with col4:
-    avg_units = lihtc_df['numberofunits'].mean() if len(lihtc_df) > 0 else 0
-    st.metric("Avg Units per Property", f"{avg_units:.1f}", help="Average number of housing units (based on rental license data) per LIHTC property in Philadelphia")
+    st.metric("Avg Units per Property", f"{total_stats['avg']:.1f}", help="Average number of housing units (based on rental license data) per LIHTC property in Philadelphia")
 
 st.divider()
 
@@ -83,7 +197,7 @@ col_geo1, col_geo2, col_geo3 = st.columns(3)
 
 with col_geo1:
     # Council district filter with names
-    council_options = ['All'] + sorted(lihtc_df['council_district'].dropna().unique().tolist())
+    council_options = ['All'] + filter_options['council']
     selected_district = st.selectbox(
         "Select a Council District:",
         options=council_options,
@@ -94,7 +208,7 @@ with col_geo1:
 with col_geo2:
     # Senate district filter
     senate_mapping = {'1': 'Saval, Nikil', '8': 'Williams, Anthony H.', '7': 'Hughes, Vincent J.', '2': 'Tartaglione, Christine M.', '4': 'Haywood, Arthur L., lll', '3': 'Street, Sharif T.', '5': 'Dillon, Jimmy'}
-    senate_options = ['All'] + sorted(lihtc_df['senate_district'].dropna().unique().tolist())
+    senate_options = ['All'] + filter_options['senate']
     selected_senate = st.selectbox(
         "Select a Senate District:",
         format_func=lambda x: f'{x} - {senate_mapping[x]}' if x!='All' else x,
@@ -120,7 +234,7 @@ with col_data1:
 
 with col_data2:
     # Certification status filter (multiselect)
-    cert_statuses = sorted(lihtc_df['lhhp_certification_status'].unique().tolist())
+    cert_statuses = filter_options['cert_statuses']
     selected_cert_statuses = st.multiselect(
         "Lead Certification Status:",
         options=cert_statuses,
@@ -166,8 +280,7 @@ with col_data5:
     st.write("**LIHTC Latest End Date Year Range:**")
     
     # Get available years from the data
-    lihtc_df['Max End Date'] = pd.to_datetime(lihtc_df['Max End Date'], errors='coerce')
-    available_years = sorted(lihtc_df['Max End Date'].dt.year.dropna().unique())
+    available_years = sorted(lihtc_df['max_end_year'].dropna().unique())
     
     if len(available_years) > 0:
         min_year = int(available_years[0])
@@ -184,187 +297,240 @@ with col_data5:
     else:
         year_range = None
 
-# Apply filters
-filtered_df = lihtc_df.copy()
+# Apply filters (cached per filter combination; lists become tuples so the
+# arguments are hashable)
+filtered_df = apply_filters(
+    lihtc_df,
+    selected_district,
+    selected_senate,
+    tuple(selected_cert_statuses),
+    selected_rental_license,
+    min_units,
+    year_range,
+)
 
-# Filter by council district
+# Build the display title from the same filter values
 if selected_district == 'All':
     district_title = "All LIHTC Properties in Philadelphia"
 else:
-    filtered_df = filtered_df[filtered_df['council_district'] == selected_district].copy()
     district_title = f"LIHTC Properties in Council District {selected_district}"
 
-# Filter by senate district
 if selected_senate != 'All':
-    filtered_df = filtered_df[filtered_df['senate_district'] == selected_senate].copy()
     senate_title = f" in Senate District {selected_senate}"
 else:
     senate_title = ""
 
-
-# Filter by certification status
 if len(selected_cert_statuses) == 0:
-    # If no statuses selected, show no results
-    filtered_df = filtered_df.iloc[0:0].copy()  # Empty dataframe with same structure
     status_title = " (No Status Selected)"
 elif len(selected_cert_statuses) == len(cert_statuses):
-    # If all statuses selected, don't filter
     status_title = ""
+elif len(selected_cert_statuses) == 1:
+    status_title = f" with {selected_cert_statuses[0]} Status"
 else:
-    # Filter by selected statuses
-    filtered_df = filtered_df[filtered_df['lhhp_certification_status'].isin(selected_cert_statuses)].copy()
-    if len(selected_cert_statuses) == 1:
-        status_title = f" with {selected_cert_statuses[0]} Status"
-    else:
-        status_title = f" with {', '.join(selected_cert_statuses)} Status"
+    status_title = f" with {', '.join(selected_cert_statuses)} Status"
 
-# Filter by rental license status
 if selected_rental_license == 'Active':
-    # Filter for properties that have an active rental license
-    filtered_df = filtered_df[filtered_df['has_active_rental_license'] == True].copy()
     rental_title = " with Active Rental License"
 elif selected_rental_license == 'Inactive':
-    # Filter for properties that do not have an active rental license
-    filtered_df = filtered_df[filtered_df['has_active_rental_license'] == False].copy()
     rental_title = " with Inactive Rental License"
 else:
-    # Include all properties regardless of rental license status
     rental_title = ""
 
-# Filter by number of units
-if units_filter_mode == "Filter with Minimum" and min_units is not None:
-    # Filter for properties with at least the minimum number of units
-    filtered_df = filtered_df[filtered_df['numberofunits'] >= min_units].copy()
+if min_units is not None:
     units_title = f" with ≥{min_units} Units"
 else:
-    # Include all properties regardless of unit count
     units_title = ""
 
-# Filter by LIHTC Max End Date year range
 if year_range is not None:
-    start_year, end_year = year_range
-    # Convert Max End Date to datetime if not already done
-    filtered_df['Max End Date'] = pd.to_datetime(filtered_df['Max End Date'], errors='coerce')
-    # Filter by year range
-    filtered_df = filtered_df[
-        (filtered_df['Max End Date'].dt.year >= start_year) & 
-        (filtered_df['Max End Date'].dt.year <= end_year)
-    ].copy()
-    year_title = f" with LIHTC Latest End Date {start_year}-{end_year}"
+    year_title = f" with LIHTC Latest End Date {year_range[0]}-{year_range[1]}"
 else:
     year_title = ""
 
 # Create display title
 display_title = district_title + senate_title + status_title + rental_title + units_title + year_title
 
+# Nothing matched: skip the metric, map, and table work entirely
+if len(filtered_df) == 0:
+    st.info("No LIHTC properties found matching the selected filters")
+    st.stop()
+
 # Display filtered counts
 st.subheader("📈 Filtered Results")
 col1, col2, col3, col4 = st.columns(4)
+filtered_stats = overview_stats(filtered_df, (
+    selected_district, selected_senate, tuple(selected_cert_statuses),
+    selected_rental_license, min_units, year_range,
+))
 
 with col1:
-    st.metric("Properties", f"{len(filtered_df):,}")
+    st.metric("Properties", f"{filtered_stats['n']:,}")
 
 with col2:
-    numberofunits = filtered_df['numberofunits'].sum()
-    st.metric("Total Units", f"{numberofunits:,.0f}", help="Total number of housing units (based on rental license data) across all LIHTC properties in Philadelphia")
+    st.metric("Total Units", f"{filtered_stats['units']:,.0f}", help="Total number of housing units (based on rental license data) across all LIHTC properties in Philadelphia")
 
 with col3:
-    certified_properties = len(filtered_df[filtered_df['lhhp_certification_status'] == 'Certified'])
-    st.metric("Lead Certified Properties", f"{certified_properties:,}")
+    st.metric("Lead Certified Properties", f"{filtered_stats['certified']:,}")
 
 with col4:
-    avg_units = filtered_df['numberofunits'].mean() if len(filtered_df) > 0 else 0
-    st.metric("Avg Units per Property", f"{avg_units:.1f}", help="Average number of housing units (based on rental license data) per LIHTC property in Philadelphia")
+    st.metric("Avg Units per Property", f"{filtered_stats['avg']:.1f}", help="Average number of housing units (based on rental license data) per LIHTC property in Philadelphia")
 
 st.divider()
 
-# Create a map centered on Philadelphia
-m = folium.Map(
-    location=[39.9526, -75.1652],  # Philadelphia coordinates
-    zoom_start=11,
-    tiles='OpenStreetMap'
+# Marker color reflects subsidy status
+MARKER_COLORS = {'Active': 'green', 'Inactive': 'red', 'Inconclusive': 'orange'}
+
+# Popup skeleton built once; only the dynamic fields are formatted per marker
+POPUP_TMPL = (
+    "<b>Address:</b> {address}<br/>"
+    "<b>Council District:</b> {council}<br/>"
+    "<b>Senate District:</b> {senate}<br/>"
+    "<b>Units (From Rental License):</b> {units}<br/>"
+    "<b>Subsidy Status:</b> {status}<br/>"
+    "<b>LIHTC Latest End Date:</b> {end_date}"
 )
 
-# Add GeoJSON overlays based on toggles
-if show_council_districts:
-    council_geojson = folium.GeoJson(
-        'geojson/Council_Districts_2024.geojson',
-        style_function=lambda feature: {
-            'fillColor': 'lightblue',
-            'color': 'blue',
-            'weight': 2,
-            'fillOpacity': 0.1
-        },
-        tooltip=folium.GeoJsonTooltip(
-            fields=['DISTRICT'],
-            aliases=['Council District:'],
-            localize=True
-        )
-    ).add_to(m)
-
-if show_senate_districts:
-    senate_geojson = folium.GeoJson(
-        'geojson/PaSenatorial2024_03.geojson',
-        style_function=lambda feature: {
-            'fillColor': 'lightgreen',
-            'color': 'green',
-            'weight': 2,
-            'fillOpacity': 0.1
-        },
-        tooltip=folium.GeoJsonTooltip(
-            fields=['LEG_DISTRI', 'S_LASTNAME', 'S_FIRSTNAM'],
-            aliases=['Senate District:', 'Senator:', ''],
-            localize=True
-        )
-    ).add_to(m)
-
-# Add individual property points to the map
-def get_marker_color(row):
-    """Get marker color based on subsidy status"""
-    if row['Subsidy Status'] == 'Active':
-        return 'green'
-    elif row['Subsidy Status'] == 'Inactive':
-        return 'red'
-    elif row['Subsidy Status'] == 'Inconclusive':
-        return 'orange'
-    else:
-        return 'gray'
+# Above this many filtered properties the map draws one circle per grid
+# cell instead of one per property; below it every property keeps its own
+# marker and popup
+CLUSTER_THRESHOLD = 200
+
+# Collapse co-located properties into grid cells server-side: round the
+# coordinates (3 decimals ≈ one city block) and aggregate each cell to a
+# single point, so broad filter selections ship a few hundred markers to
+# the browser instead of thousands. Not cached: build_map only runs when
+# map_key changes, so this computes at most once per map rebuild.
+def cluster_points(df_view, precision=3):
+    grid = df_view.dropna(subset=['lat', 'lng'])
+    return grid.groupby(
+        [grid['lat'].round(precision), grid['lng'].round(precision)],
+        observed=True,
+    ).agg(
+        n_props=('parcel_number', 'size'),
+        lat=('lat', 'mean'),
+        lng=('lng', 'mean'),
+        n_units=('numberofunits', 'sum'),
+    ).reset_index(drop=True)
+
+def build_map(filtered_df, show_council, show_senate):
+    # Create a map centered on Philadelphia
+    m = folium.Map(
+        location=[39.9526, -75.1652],  # Philadelphia coordinates
+        zoom_start=11,
+        tiles='OpenStreetMap',
+        # Render markers on a single canvas instead of one SVG/DOM node each;
+        # keeps panning/zooming smooth with thousands of points
+        prefer_canvas=True
+    )
+
+    # Add GeoJSON overlays based on toggles
+    if show_council:
+        folium.GeoJson(
+            load_geojson('geojson/Council_Districts_2024.geojson', ('DISTRICT',)),
+            style_function=lambda feature: {
+                'fillColor': 'lightblue',
+                'color': 'blue',
+                'weight': 2,
+                'fillOpacity': 0.1
+            },
+            tooltip=folium.GeoJsonTooltip(
+                fields=['DISTRICT'],
+                aliases=['Council District:'],
+                localize=True
+            )
+        ).add_to(m)
 
-# Add markers for each filtered property
-for idx, row in filtered_df.iterrows():
-    if pd.notna(row['lat']) and pd.notna(row['lng']):
+    if show_senate:
+        folium.GeoJson(
+            load_geojson('geojson/PaSenatorial2024_03.geojson', ('LEG_DISTRI', 'S_LASTNAME', 'S_FIRSTNAM')),
+            style_function=lambda feature: {
+                'fillColor': 'lightgreen',
+                'color': 'green',
+                'weight': 2,
+                'fillOpacity': 0.1
+            },
+            tooltip=folium.GeoJsonTooltip(
+                fields=['LEG_DISTRI', 'S_LASTNAME', 'S_FIRSTNAM'],
+                aliases=['Senate District:', 'Senator:', ''],
+                localize=True
+            )
+        ).add_to(m)
+
+    # Large result sets: draw the clustered grid instead of per-property
+    # markers, sized by how many properties share the cell
+    if len(filtered_df) > CLUSTER_THRESHOLD:
+        for r in cluster_points(filtered_df).itertuples(index=False):
+            folium.CircleMarker(
+                location=[r.lat, r.lng],
+                radius=6 + np.log(r.n_props) * 2,
+                popup=folium.Popup(
+                    f"<b>{r.n_props} properties</b> ({r.n_units:.0f} units)<br/>"
+                    "Zoom in or narrow the filters for per-property details",
+                    max_width=300
+                ),
+                color='black',
+                weight=1,
+                fillColor='blue',
+                fillOpacity=0.6
+            ).add_to(m)
+        return m
+
+    # Slice down to the columns the popups need (renamed so itertuples exposes
+    # them as attributes) and vectorize the color lookup before the loop
+    marker_df = filtered_df.dropna(subset=['lat', 'lng'])[
+        ['lat', 'lng', 'parcel_address', 'council_district', 'senate_district', 'numberofunits', 'Subsidy Status', 'max_end_date_str']
+    ].rename(columns={'Subsidy Status': 'subsidy_status'})
+    marker_df = marker_df.assign(marker_color=marker_df['subsidy_status'].map(MARKER_COLORS).fillna('gray'))
+
+    # Add markers for each filtered property
+    for r in marker_df.itertuples(index=False):
         folium.CircleMarker(
-            location=[row['lat'], row['lng']],
+            location=[r.lat, r.lng],
             radius=6,
             popup=folium.Popup(
-                f"""
-                <b>Address:</b> {row['parcel_address']}<br/>
-                <b>Council District:</b> {row['council_district']}<br/>
-                <b>Senate District:</b> {row['senate_district']}<br/>
-                <b>Units (From Rental License):</b> {row['numberofunits']}<br/>
-                <b>Subsidy Status:</b> {row['Subsidy Status']}<br/>
-                <b>LIHTC Latest End Date:</b> {row['Max End Date']}
-                """,
+                POPUP_TMPL.format(
+                    address=r.parcel_address,
+                    council=r.council_district,
+                    senate=r.senate_district,
+                    units=r.numberofunits,
+                    status=r.subsidy_status,
+                    end_date=r.max_end_date_str,
+                ),
                 max_width=300
             ),
             color='black',
             weight=1,
-            fillColor=get_marker_color(row),
+            fillColor=r.marker_color,
             fillOpacity=0.7
         ).add_to(m)
 
+    return m
+
+# Rebuild the folium map only when its inputs change; unrelated reruns (like
+# detail-panel interactions) reuse the object stored in session state
+map_key = (
+    selected_district, selected_senate, tuple(selected_cert_statuses),
+    selected_rental_license, min_units, year_range,
+    show_council_districts, show_senate_districts,
+)
+if st.session_state.get('map_key') != map_key:
+    st.session_state.map_key = map_key
+    st.session_state.map = build_map(filtered_df, show_council_districts, show_senate_districts)
+m = st.session_state.map
+
 # Function to find the nearest property to clicked coordinates
 def find_nearest_property(lat, lng, df):
     """Find the nearest property to the clicked coordinates"""
     if df.empty:
         return None
-    
-    # Calculate distance from clicked point to each property
-    df['distance'] = ((df['lat'] - lat) ** 2 + (df['lng'] - lng) ** 2) ** 0.5
-    
+
+    # Squared-distance argmin on raw NumPy arrays: no sqrt needed for
+    # ranking, and no distance column written onto the filtered frame
+    lat_arr = df['lat'].to_numpy()
+    lng_arr = df['lng'].to_numpy()
+    d2 = (lat_arr - lat) ** 2 + (lng_arr - lng) ** 2
+
     # Return the nearest property
-    nearest_idx = df['distance'].idxmin()
-    return df.loc[nearest_idx]
+    return df.iloc[np.nanargmin(d2)]
 
 # Map section
 st.subheader("🗺️ Property Map")
@@ -404,218 +570,236 @@ if map_data['last_object_clicked'] is not None:
 
 st.divider()
 
-# Display filtered properties table
-st.subheader("📋 Property Details")
-st.write(display_title)
-
-# Select and rename columns for display
-display_columns = {
-    'parcel_address': 'Address',
-    'council_district': 'Council District',
-    'senate_district': 'Senate District',
-    'numberofunits': 'Units (From RL)',
-    'lhhp_certification_status': 'Lead Certification Status',
-    'lhhp_cert_expiration_date': 'Lead Expiration Date',
-    'Subsidy Status': 'LIHTC Status',
-    'Max End Date': 'LIHTC Latest End Date',
-    'num_associated_hud_properties': 'Associated HUD Properties'
-}
+# The detail panel reruns on its own (st.fragment) so interacting with it
+# doesn't re-run the filters, rebuild the map, or re-emit every marker
+@st.fragment
+def render_property_details(filtered_df):
+    st.divider()
+    st.subheader("🔍 Selected Property Details")
 
-# Filter to only show selected columns
-display_df = filtered_df[list(display_columns.keys())].copy()
 
-# Rename columns for better display
-display_df = display_df.rename(columns=display_columns)
-
-# Format date columns
-if 'Certification Date' in display_df.columns:
-    display_df['Certification Date'] = pd.to_datetime(display_df['Certification Date'], errors='coerce').dt.strftime('%Y-%m-%d')
-if 'Expiration Date' in display_df.columns:
-    display_df['Expiration Date'] = pd.to_datetime(display_df['Expiration Date'], errors='coerce').dt.strftime('%Y-%m-%d')
-
-# Display the table
-if len(display_df) > 0:
-    # Initialize session state for selected row
-    if 'selected_row' not in st.session_state:
-        st.session_state.selected_row = None
     
-    # Display the table with row selection
-    selected_rows = st.dataframe(
-        display_df,
-        width='stretch',
-        hide_index=True,
-        selection_mode="single-row",
-        on_select="rerun",
-        key="property_table"
-    )
+    # Get the selected property data
+    selected_property = filtered_df.iloc[st.session_state.selected_row]
+    parcel_number = selected_property['parcel_number']
+
+    # Create two columns for better layout
+    col1, col2 = st.columns(2)
     
-    # Update selected row in session state
-    if selected_rows.selection.rows:
-        selected_idx = selected_rows.selection.rows[0]
-        st.session_state.selected_row = selected_idx
-    else:
-        st.session_state.selected_row = None
+    with col1:
+        st.write("**Basic Information**")
+        basic_info = {
+            'Address': selected_property['parcel_address'],
+            'Parcel Number': selected_property['parcel_number'],
+            'Council District': selected_property['council_district'],
+            'Senate District': selected_property['senate_district'],
+            'Number of Units': selected_property['numberofunits'],
+            'Latitude': selected_property['lat'],
+            'Longitude': selected_property['lng']
+        }
+        
+        for key, value in basic_info.items():
+            st.write(f"**{key}:** {value}")
     
-    # Show detailed property information if a row is selected
-    if st.session_state.selected_row is not None:
-        st.divider()
-        st.subheader("🔍 Selected Property Details")
-
-
+    with col2:
+        st.write("**Certification & Compliance**")
+        cert_info = {
+            'Certification Status': selected_property['lhhp_certification_status'],
+            'Certification Type': selected_property['lhhp_status_type'],
+            'Certification Date': selected_property['lhhp_cert_date'],
+            'Expiration Date': selected_property['lhhp_cert_expiration_date'],
+            'Has Active Rental License': selected_property['has_active_rental_license']
+        }
         
-        # Get the selected property data
-        selected_property = filtered_df.iloc[st.session_state.selected_row]
-        parcel_number = selected_property['parcel_number']
+        for key, value in cert_info.items():
+            st.write(f"**{key}:** {value}")
+    
+    # Property violations section - as a prominent subcategory
+    st.markdown("---")  # Add a divider line
+    st.markdown("### 🚨 Property Violations (Last 5 Years)")
+    
+    # Load violations data from CSV
+    df_all_violations = load_violations_data()
+    if parcel_number in df_all_violations.index:
+        df_violations = df_all_violations.loc[[parcel_number]]
+    else:
+        df_violations = df_all_violations.iloc[0:0]
 
-        # Create two columns for better layout
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.write("**Basic Information**")
-            basic_info = {
-                'Address': selected_property['parcel_address'],
-                'Parcel Number': selected_property['parcel_number'],
-                'Council District': selected_property['council_district'],
-                'Senate District': selected_property['senate_district'],
-                'Number of Units': selected_property['numberofunits'],
-                'Latitude': selected_property['lat'],
-                'Longitude': selected_property['lng']
-            }
+    # Filter to last 5 years
+    if not df_violations.empty:
+        five_years_ago = pd.Timestamp.now() - pd.DateOffset(years=5)
+        df_violations = df_violations[df_violations['violationdate'] >= five_years_ago]
+        df_violations = df_violations.sort_values('violationdate', ascending=False)
+    
+    if not df_violations.empty:
+        # Create a container with background color for violations section
+        with st.container():
+            st.markdown("**Violation Summary by Type:**")
+            # value_counts is a single hashed count with already-sorted output;
+            # drop the zero rows it reports for unobserved categories
+            violation_counts = (
+                df_violations['violationcodetitle']
+                .value_counts()
+                .loc[lambda s: s > 0]
+                .rename_axis('violationcodetitle')
+                .reset_index(name='count')
+            )
             
-            for key, value in basic_info.items():
-                st.write(f"**{key}:** {value}")
-        
-        with col2:
-            st.write("**Certification & Compliance**")
-            cert_info = {
-                'Certification Status': selected_property['lhhp_certification_status'],
-                'Certification Type': selected_property['lhhp_status_type'],
-                'Certification Date': selected_property['lhhp_cert_date'],
-                'Expiration Date': selected_property['lhhp_cert_expiration_date'],
-                'Has Active Rental License': selected_property['has_active_rental_license']
-            }
+            # Display the summary table
+            st.dataframe(
+                violation_counts,
+                width='stretch',
+                hide_index=True,
+                column_config={
+                    "violation_code_title": "Violation Type",
+                    "count": "Count"
+                }
+            )
             
-            for key, value in cert_info.items():
-                st.write(f"**{key}:** {value}")
-        
-        # Property violations section - as a prominent subcategory
-        st.markdown("---")  # Add a divider line
-        st.markdown("### 🚨 Property Violations (Last 5 Years)")
-        
-        # Load violations data from CSV
-        df_all_violations = load_violations_data()
-        df_violations = df_all_violations[df_all_violations['opa_account_num'] == parcel_number].copy()
-        
-        # Filter to last 5 years
-        if not df_violations.empty:
-            df_violations['violationdate'] = pd.to_datetime(df_violations['violationdate'], errors='coerce')
-            five_years_ago = pd.Timestamp.now() - pd.DateOffset(years=5)
-            df_violations = df_violations[df_violations['violationdate'] >= five_years_ago].copy()
-            df_violations = df_violations.sort_values('violationdate', ascending=False)
-        
-        if not df_violations.empty:
-            # Create a container with background color for violations section
-            with st.container():
-                st.markdown("**Violation Summary by Type:**")
-                violation_counts = df_violations.groupby('violationcodetitle').size().reset_index(name='count')
-                violation_counts = violation_counts.sort_values('count', ascending=False)
-                
-                # Display the summary table
+            # Show total violations with emphasis
+            total_violations = len(df_violations)
+            st.markdown(f"**Total Violations (Last 5 Years):** `{total_violations}`")
+            
+            # Show detailed violations in an expandable section
+            with st.expander("📋 View All Violation Details"):
                 st.dataframe(
-                    violation_counts,
+                    df_violations,
                     width='stretch',
                     hide_index=True,
-                    column_config={
-                        "violation_code_title": "Violation Type",
-                        "count": "Count"
-                    }
                 )
-                
-                # Show total violations with emphasis
-                total_violations = len(df_violations)
-                st.markdown(f"**Total Violations (Last 5 Years):** `{total_violations}`")
-                
-                # Show detailed violations in an expandable section
-                with st.expander("📋 View All Violation Details"):
-                    st.dataframe(
-                        df_violations,
-                        width='stretch',
-                        hide_index=True,
-                    )
-        else:
-            st.info("✅ No violations found for this property in the last 5 years")
-        
-        # Property subsidies section - as a prominent subcategory
-        st.markdown("---")  # Add a divider line
-        st.markdown("### 💰 Property Subsidies")
-        
-        # Load subsidies data from CSV
-        df_all_subsidies = load_subsidies_data()
-        df_subsidies = df_all_subsidies[df_all_subsidies['parcel_number'] == parcel_number].copy()
-        
-        if not df_subsidies.empty:
-            # Create a container for subsidies section
-            with st.container():
-                st.markdown("**Subsidy Summary by Type:**")
-                subsidy_counts = df_subsidies.groupby('Subsidy Name').size().reset_index(name='count')
-                subsidy_counts = subsidy_counts.sort_values('count', ascending=False)
-                
-                # Display the summary table
+    else:
+        st.info("✅ No violations found for this property in the last 5 years")
+    
+    # Property subsidies section - as a prominent subcategory
+    st.markdown("---")  # Add a divider line
+    st.markdown("### 💰 Property Subsidies")
+    
+    # Load subsidies data from CSV
+    df_all_subsidies = load_subsidies_data()
+    if parcel_number in df_all_subsidies.index:
+        df_subsidies = df_all_subsidies.loc[[parcel_number]]
+    else:
+        df_subsidies = df_all_subsidies.iloc[0:0]
+    
+    if not df_subsidies.empty:
+        # Create a container for subsidies section
+        with st.container():
+            st.markdown("**Subsidy Summary by Type:**")
+            subsidy_counts = (
+                df_subsidies['Subsidy Name']
+                .value_counts()
+                .loc[lambda s: s > 0]
+                .rename_axis('Subsidy Name')
+                .reset_index(name='count')
+            )
+            
+            # Display the summary table
+            st.dataframe(
+                subsidy_counts,
+                width='stretch',
+                hide_index=True,
+                column_config={
+                    "count": "Count"
+                }
+            )
+            
+            # Show total subsidies with emphasis
+            total_subsidies = len(df_subsidies)
+            st.markdown(f"**Total Subsidies:** `{total_subsidies}`")
+            
+            # Show detailed subsidies in an expandable section
+            with st.expander("📋 View All Subsidy Details"):
                 st.dataframe(
-                    subsidy_counts,
+                    df_subsidies,
                     width='stretch',
                     hide_index=True,
-                    column_config={
-                        "count": "Count"
-                    }
                 )
-                
-                # Show total subsidies with emphasis
-                total_subsidies = len(df_subsidies)
-                st.markdown(f"**Total Subsidies:** `{total_subsidies}`")
-                
-                # Show detailed subsidies in an expandable section
-                with st.expander("📋 View All Subsidy Details"):
-                    st.dataframe(
-                        df_subsidies,
-                        width='stretch',
-                        hide_index=True,
-                    )
-        else:
-            st.info("ℹ️ No subsidies found for this property")
-        
-        # Additional details in full width
-        st.write("**Additional Details**")
-        additional_info = {
-            'Max End Date': selected_property['Max End Date'],
-            'Associated HUD Properties': selected_property['num_associated_hud_properties'],
-            'Property Type': selected_property.get('property_type', 'N/A'),
-            'Owner Name': selected_property.get('owner_name', 'N/A'),
-            'Owner Address': selected_property.get('owner_address', 'N/A')
-        }
-        
-        # Display additional info in a more compact format
-        info_cols = st.columns(3)
-        for i, (key, value) in enumerate(additional_info.items()):
-            with info_cols[i % 3]:
-                st.write(f"**{key}:** {value}")
-        
-        # Show all available columns in an expandable section
-        with st.expander("📋 All Property Data (Raw)"):
-            # Get all columns and their values
-            all_data = selected_property.to_dict()
-            
-            # Create a more readable format
-            for col, val in all_data.items():
-                if pd.notna(val) and val != '':
-                    st.write(f"**{col}:** {val}")
-                else:
-                    st.write(f"**{col}:** *No data*")
-        
-        # Add a button to clear selection
-        if st.button("Clear Selection", type="secondary"):
-            st.session_state.selected_row = None
-            st.rerun()
+    else:
+        st.info("ℹ️ No subsidies found for this property")
+    
+    # Additional details in full width
+    st.write("**Additional Details**")
+    additional_info = {
+        'Max End Date': selected_property['Max End Date'],
+        'Associated HUD Properties': selected_property['num_associated_hud_properties'],
+        'Property Type': selected_property.get('property_type', 'N/A'),
+        'Owner Name': selected_property.get('owner_name', 'N/A'),
+        'Owner Address': selected_property.get('owner_address', 'N/A')
+    }
+    
+    # Display additional info in a more compact format
+    info_cols = st.columns(3)
+    for i, (key, value) in enumerate(additional_info.items()):
+        with info_cols[i % 3]:
+            st.write(f"**{key}:** {value}")
+    
+    # Show all available columns in an expandable section
+    with st.expander("📋 All Property Data (Raw)"):
+        # Get all columns and their values
+        all_data = selected_property.to_dict()
         
+        # Create a more readable format
+        for col, val in all_data.items():
+            if pd.notna(val) and val != '':
+                st.write(f"**{col}:** {val}")
+            else:
+                st.write(f"**{col}:** *No data*")
+    
+    # Add a button to clear selection
+    if st.button("Clear Selection", type="secondary"):
+        st.session_state.selected_row = None
+        st.rerun(scope="app")
+    
+
+# Display filtered properties table
+st.subheader("📋 Property Details")
+st.write(display_title)
+
+# Select and rename columns for display
+display_columns = {
+    'parcel_address': 'Address',
+    'council_district': 'Council District',
+    'senate_district': 'Senate District',
+    'numberofunits': 'Units (From RL)',
+    'lhhp_certification_status': 'Lead Certification Status',
+    'lhhp_cert_expiration_date': 'Lead Expiration Date',
+    'Subsidy Status': 'LIHTC Status',
+    'Max End Date': 'LIHTC Latest End Date',
+    'num_associated_hud_properties': 'Associated HUD Properties'
+}
+
+# Select and rename the display columns in one pass
+display_df = filtered_df[list(display_columns.keys())].rename(columns=display_columns)
+
+# Cap what gets serialized to the browser; row-selection indices still line
+# up with filtered_df because only the leading rows are shown
+MAX_TABLE_ROWS = 500
+if len(display_df) > MAX_TABLE_ROWS:
+    st.caption(f"Showing the first {MAX_TABLE_ROWS:,} of {len(display_df):,} properties — narrow the filters to see the rest.")
+    display_df = display_df.head(MAX_TABLE_ROWS)
+
+# Display the table (the empty case already exited above)
+# Initialize session state for selected row
+if 'selected_row' not in st.session_state:
+    st.session_state.selected_row = None
+
+# Display the table with row selection
+selected_rows = st.dataframe(
+    display_df,
+    width='stretch',
+    hide_index=True,
+    selection_mode="single-row",
+    on_select="rerun",
+    key="property_table"
+)
+
+# Update selected row in session state
+if selected_rows.selection.rows:
+    selected_idx = selected_rows.selection.rows[0]
+    st.session_state.selected_row = selected_idx
 else:
-    st.info(f"No LIHTC properties found matching the selected filters")
+    st.session_state.selected_row = None
+
+# Show detailed property information if a row is selected
+if st.session_state.selected_row is not None:
+    render_property_details(filtered_df)